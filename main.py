@@ -1,48 +1,139 @@
 import os
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse
+import time
+from urllib.parse import quote
+import asyncpg
+import redis.asyncio as redis
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from supabase import create_client, Client
 from dotenv import load_dotenv
-import json
+import orjson
 import asyncio
 from sse_starlette.sse import EventSourceResponse
+from starlette.middleware.gzip import GZipMiddleware
 from starlette.requests import Request
 import asyncio
 
 # --- Real-time Broadcast Manager ---
 class BroadcastManager:
     def __init__(self):
+        # Replaced wholesale under the lock, never mutated in place, so
+        # broadcast() can iterate a snapshot without holding the lock
         self.subscribers = []
         self.lock = asyncio.Lock()
 
+    def new_queue(self):
+        # One slot: each message is a full snapshot, so only the latest matters
+        return asyncio.Queue(maxsize=1)
+
     async def subscribe(self, queue):
         async with self.lock:
-            self.subscribers.append(queue)
+            self.subscribers = self.subscribers + [queue]
 
     async def unsubscribe(self, queue):
         async with self.lock:
-            self.subscribers.remove(queue)
+            self.subscribers = [q for q in self.subscribers if q is not queue]
 
     async def broadcast(self, message: str):
-        async with self.lock:
-            for queue in self.subscribers:
-                await queue.put(message)
+        for queue in self.subscribers:
+            # Replace any snapshot the client hasn't consumed yet
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            queue.put_nowait(message)
 
 broadcaster = BroadcastManager()
 
+# --- Micro-batched Removals ---
+class RemovalBatcher:
+    """
+    Collects decrements for a short window and removes them with one query per queue.
+    """
+    def __init__(self, pool, window: float):
+        self.pool = pool
+        self.window = window
+        self.pending = {}
+        # The task still collecting removals, if any
+        self.flush_task = None
+        # Every flush task that hasn't finished, including ones already querying
+        self.in_flight = set()
+
+    async def remove(self, queue_name: str, phone_number: str) -> bool:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(queue_name, []).append((phone_number, future))
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_after_window())
+            self.in_flight.add(self.flush_task)
+            self.flush_task.add_done_callback(self.in_flight.discard)
+        return await future
+
+    async def drain(self):
+        """
+        Waits until every removal accepted so far has been applied.
+        """
+        while self.in_flight:
+            await asyncio.gather(*self.in_flight, return_exceptions=True)
+
+    async def flush_after_window(self):
+        await asyncio.sleep(self.window)
+        pending, self.pending = self.pending, {}
+        self.flush_task = None
+        await asyncio.gather(*(self.flush(q, entries) for q, entries in pending.items()))
+
+    async def flush(self, queue_name: str, entries):
+        try:
+            async with self.pool.acquire() as conn:
+                records = await conn.fetch(
+                    "SELECT phone_number FROM remove_callers_batch($1, $2)",
+                    queue_name, list({phone for phone, _ in entries})
+                )
+        except Exception as e:
+            for _, future in entries:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        removed = {record['phone_number'] for record in records}
+        for phone, future in entries:
+            # Only the first of several identical requests gets credit for the removal
+            if not future.done():
+                future.set_result(phone in removed)
+            removed.discard(phone)
+
+REMOVAL_BATCH_WINDOW_SECONDS = 0.05
+
+# EventSourceResponse pings idle SSE connections this often so proxies keep them open
+SSE_KEEPALIVE_SECONDS = 15
+
+# Set on queue_changed notifications from Postgres; the summary pump picks it up
+summary_dirty = asyncio.Event()
+SUMMARY_DEBOUNCE_SECONDS = 0.1
+LISTEN_RETRY_SECONDS = 5
+LISTEN_HEALTHCHECK_SECONDS = 30
+
 # Load environment variables from .env file
 load_dotenv()
 
-# Supabase setup
-supabase_url = os.environ.get("SUPABASE_URL")
-supabase_key = os.environ.get("SUPABASE_KEY")
+# Postgres connection string (Supabase: Project Settings > Database). Must be
+# a session connection (session pooler on 5432, or direct): the transaction
+# pooler on 6543 breaks asyncpg's prepared statements and LISTEN.
+database_url = os.environ.get("DATABASE_URL")
+
+if not database_url:
+    raise Exception("DATABASE_URL must be set in the .env file")
 
-if not supabase_url or not supabase_key:
-    raise Exception("Supabase URL and Key must be set in the .env file")
+# Per-worker pool size. Each worker also holds one LISTEN connection, so the
+# service uses up to workers * (DB_POOL_MAX_SIZE + 1) database connections.
+db_pool_max_size = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+db_pool_min_size = min(int(os.environ.get("DB_POOL_MIN_SIZE", "2")), db_pool_max_size)
 
-supabase: Client = create_client(supabase_url, supabase_key)
+# Optional Redis for rejecting duplicate callers without touching Postgres
+redis_url = os.environ.get("REDIS_URL")
+CALLER_KEY_TTL_SECONDS = 3600
+# Kept short so an unreachable Redis falls through to the database quickly
+REDIS_TIMEOUT_SECONDS = 0.2
 
 templates = Jinja2Templates(directory="templates")
 
@@ -50,45 +141,110 @@ app = FastAPI(
     title="Five9 Queue Management Service",
     description="A service to manage caller positions in a queue.",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
+# Compresses the JSON API responses; Starlette leaves text/event-stream alone
+app.add_middleware(GZipMiddleware, minimum_size=200)
+
+@app.on_event("startup")
+async def startup():
+    app.state.pool = await asyncpg.create_pool(
+        dsn=database_url, min_size=db_pool_min_size, max_size=db_pool_max_size, command_timeout=5
+    )
+    app.state.redis = redis.Redis.from_url(
+        redis_url,
+        socket_connect_timeout=REDIS_TIMEOUT_SECONDS,
+        socket_timeout=REDIS_TIMEOUT_SECONDS,
+    ) if redis_url else None
+    app.state.removal_batcher = RemovalBatcher(app.state.pool, REMOVAL_BATCH_WINDOW_SECONDS)
+    app.state.summary_pump = asyncio.create_task(summary_pump())
+    app.state.queue_listener = asyncio.create_task(queue_change_listener())
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.summary_pump.cancel()
+    app.state.queue_listener.cancel()
+    await asyncio.gather(app.state.queue_listener, return_exceptions=True)
+    # Decrements already accepted still need the pool
+    await app.state.removal_batcher.drain()
+    await app.state.pool.close()
+    if app.state.redis is not None:
+        await app.state.redis.aclose()
+
+async def get_conn(request: Request):
+    """
+    Borrows a pooled connection for the duration of a single request.
+    """
+    async with request.app.state.pool.acquire() as conn:
+        yield conn
 
 class Caller(BaseModel):
     phone_number: str
     queue_name: str
 
+def caller_key(caller: Caller) -> str:
+    # Percent-encode the parts so a ':' inside either one can't cause collisions
+    return f"q:{quote(caller.queue_name, safe='')}:{quote(caller.phone_number, safe='')}"
+
+async def claim_caller(r, caller: Caller) -> bool:
+    """
+    Marks the caller as queued in Redis. Returns False only if Redis already
+    has them; when Redis is missing or unavailable the database decides.
+    """
+    if r is None:
+        return True
+    try:
+        return bool(await r.set(caller_key(caller), "1", nx=True, ex=CALLER_KEY_TTL_SECONDS))
+    except redis.RedisError as e:
+        print(f"Redis unavailable, falling back to database: {e}")
+        return True
+
+async def release_caller(r, caller: Caller):
+    if r is None:
+        return
+    try:
+        await r.delete(caller_key(caller))
+    except redis.RedisError as e:
+        print(f"Error clearing Redis key: {e}")
+
 @app.post("/queue/increment")
-async def increment_queue(caller: Caller):
+async def increment_queue(caller: Caller, request: Request):
     """
     Adds a caller to a queue atomically using a database function and returns their position.
     """
+    r = request.app.state.redis
+    if not await claim_caller(r, caller):
+        raise HTTPException(status_code=409, detail="Caller is already in this queue.")
+    # Whether the database agrees the caller is queued, i.e. the Redis key is accurate
+    in_queue = False
     try:
-        result = supabase.rpc('add_caller_to_queue', {
-            'p_phone_number': caller.phone_number,
-            'p_queue_name': caller.queue_name
-        }).execute()
-        new_position = result.data
-        # After a successful update, trigger a broadcast
-        await broadcast_update()
+        async with request.app.state.pool.acquire() as conn:
+            new_position = await conn.fetchval(
+                "SELECT add_caller_to_queue($1, $2)", caller.phone_number, caller.queue_name
+            )
+        in_queue = True
         return {"position": new_position}
+    except asyncpg.UniqueViolationError:
+        # The database is the source of truth; the Redis key now matches it
+        in_queue = True
+        raise HTTPException(status_code=409, detail="Caller is already in this queue.")
     except Exception as e:
-        if 'Caller is already in queue' in str(e):
-            raise HTTPException(status_code=409, detail="Caller is already in this queue.")
         raise HTTPException(status_code=500, detail=f"An unexpected database error occurred: {e}")
+    finally:
+        # Also runs when the request is cancelled before the insert is confirmed
+        if not in_queue:
+            await release_caller(r, caller)
 
 @app.post("/queue/decrement")
-async def decrement_queue(caller: Caller):
+async def decrement_queue(caller: Caller, request: Request):
     """
-    Removes a caller from the queue atomically using a database function.
+    Removes a caller from the queue. Removals arriving within a few milliseconds
+    of each other are applied together in a single database call.
     """
     try:
-        result = supabase.rpc('remove_caller_from_queue', {
-            'p_phone_number': caller.phone_number,
-            'p_queue_name': caller.queue_name
-        }).execute()
-        deleted_position = result.data
-        if deleted_position > 0:
-            # After a successful update, trigger a broadcast
-            await broadcast_update()
+        removed = await request.app.state.removal_batcher.remove(caller.queue_name, caller.phone_number)
+        await release_caller(request.app.state.redis, caller)
+        if removed:
             return {"message": f"Caller {caller.phone_number} removed from queue {caller.queue_name}."}
         else:
             return {"message": "Caller not found in the queue or already removed."}
@@ -102,23 +258,31 @@ class CallerStatus(BaseModel):
     position: int | None = None
 
 @app.get("/queue/status", response_model=CallerStatus)
-def get_caller_status(phone_number: str, queue_name: str):
+async def get_caller_status(phone_number: str, queue_name: str, conn: asyncpg.Connection = Depends(get_conn)):
     """
     Checks if a specific caller is currently in a queue and returns their status and position.
     This is useful for checking if a caller abandoned before decrementing the queue.
     """
     try:
-        response = supabase.table('queue').select('id, position').match({
-            'phone_number': phone_number,
-            'queue_name': queue_name
-        }).execute()
-
-        if response.data:
+        # Positions are derived from arrival order rather than stored
+        position = await conn.fetchval(
+            """
+            SELECT position FROM (
+                SELECT phone_number, row_number() OVER (ORDER BY inserted_at, id) AS position
+                FROM queue
+                WHERE queue_name = $1
+            ) ranked
+            WHERE phone_number = $2
+            """,
+            queue_name, phone_number
+        )
+
+        if position is not None:
             return {
                 "phone_number": phone_number,
                 "queue_name": queue_name,
                 "in_queue": True,
-                "position": response.data[0]['position']
+                "position": position
             }
         else:
             return {
@@ -131,79 +295,164 @@ def get_caller_status(phone_number: str, queue_name: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Short-lived per-queue counts so dashboards polling /queue/count share one query
+# Queue names come straight from the URL, so the cache is capped and in-flight
+# refreshes are only tracked while they run.
+COUNT_CACHE_TTL_SECONDS = 0.5
+COUNT_CACHE_MAX_ENTRIES = 1024
+count_cache: dict[str, tuple[float, int]] = {}
+count_refreshes: dict[str, asyncio.Future] = {}
+
+def store_queue_count(queue_name: str, count: int):
+    now = time.monotonic()
+    count_cache.pop(queue_name, None)
+    if len(count_cache) >= COUNT_CACHE_MAX_ENTRIES:
+        expired = [name for name, (t, _) in count_cache.items() if now - t >= COUNT_CACHE_TTL_SECONDS]
+        for name in expired:
+            del count_cache[name]
+        # Still full of fresh entries: drop the oldest
+        while len(count_cache) >= COUNT_CACHE_MAX_ENTRIES:
+            del count_cache[next(iter(count_cache))]
+    count_cache[queue_name] = (now, count)
+
+async def refresh_queue_count(pool, queue_name: str) -> int:
+    async with pool.acquire() as conn:
+        count = await conn.fetchval(
+            "SELECT COALESCE((SELECT count FROM queue_stats WHERE queue_name = $1), 0)", queue_name
+        )
+    store_queue_count(queue_name, count)
+    return count
+
+async def cached_queue_count(pool, queue_name: str) -> int:
+    cached = count_cache.get(queue_name)
+    if cached and time.monotonic() - cached[0] < COUNT_CACHE_TTL_SECONDS:
+        return cached[1]
+
+    # Only one request per queue refreshes the count; the rest await it
+    refresh = count_refreshes.get(queue_name)
+    if refresh is None:
+        refresh = asyncio.ensure_future(refresh_queue_count(pool, queue_name))
+        count_refreshes[queue_name] = refresh
+        refresh.add_done_callback(lambda _: count_refreshes.pop(queue_name, None))
+    # A disconnecting client must not cancel the refresh others are waiting on
+    return await asyncio.shield(refresh)
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Weak comparison of an ETag against an If-None-Match header, which may be
+    a comma-separated list of tags or "*".
+    """
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == opaque:
+            return True
+    return False
+
 @app.get("/queue/count/{queue_name}")
-def get_queue_count(queue_name: str):
+async def get_queue_count(queue_name: str, request: Request):
     """
     Returns the current number of callers in a specific queue.
+    Counts may be up to half a second stale.
     """
     try:
-        # Use count='exact' for an efficient count query
-        response = supabase.table('queue').select('id', count='exact').eq('queue_name', queue_name).execute()
-        
-        count = response.count if response.count is not None else 0
-        
-        return {"queue_name": queue_name, "count": count}
+        count = await cached_queue_count(request.app.state.pool, queue_name)
+
+        # The URL already identifies the queue, so the tag only needs the count
+        headers = {"Cache-Control": "public, max-age=1", "ETag": f'W/"{count}"'}
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        return ORJSONResponse({"queue_name": queue_name, "count": count}, headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/queues/summary")
-def get_queues_summary():
+async def get_queues_summary(conn: asyncpg.Connection = Depends(get_conn)):
     """
     Returns a summary of all active queues and their current caller counts.
     """
     try:
-        # This query will group by queue_name and count the callers in each.
-        # Note: Supabase Python client doesn't directly support GROUP BY. 
-        # We fetch all records and process them in Python.
-        response = supabase.table('queue').select('queue_name').execute()
-        
-        if not response.data:
-            return {"queues": []}
-
-        # Count occurrences of each queue name
-        queue_counts = {}
-        for record in response.data:
-            q_name = record['queue_name']
-            queue_counts[q_name] = queue_counts.get(q_name, 0) + 1
-
-        # Format the output
-        summary = [{'queue_name': name, 'count': count} for name, count in queue_counts.items()]
-        
-        return {"queues": summary}
+        records = await conn.fetch("SELECT queue_name, count FROM get_queue_summary()")
+
+        return {"queues": [dict(record) for record in records]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# Helper function to fetch the latest summary and broadcast it
-async def broadcast_update():
-    try:
-        response = supabase.rpc('get_queue_summary').execute()
-        summary = response.data or {}
-        await broadcaster.broadcast(json.dumps(summary))
-    except Exception as e:
-        print(f"Error broadcasting update: {e}")
+# Background task that keeps a LISTEN connection open and marks the summary
+# dirty on every queue_changed notification. LISTEN needs a dedicated
+# connection that never goes back to the pool; if it drops we reconnect.
+async def queue_change_listener():
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(dsn=database_url)
+            closed = asyncio.Event()
+            conn.add_termination_listener(lambda c: closed.set())
+            await conn.add_listener('queue_changed', lambda *args: summary_dirty.set())
+            # Changes made while we weren't listening were never notified
+            summary_dirty.set()
+            while not conn.is_closed():
+                try:
+                    await asyncio.wait_for(closed.wait(), timeout=LISTEN_HEALTHCHECK_SECONDS)
+                except asyncio.TimeoutError:
+                    # Catches connections that died without the socket noticing
+                    await conn.fetchval("SELECT 1", timeout=5)
+            print("Listen connection closed, reconnecting.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Listen connection failed, reconnecting: {e}")
+        finally:
+            if conn is not None and not conn.is_closed():
+                conn.terminate()
+        await asyncio.sleep(LISTEN_RETRY_SECONDS)
+
+# Background task that fetches the latest summary and broadcasts it.
+# Bursts of writes within the debounce window collapse into a single query.
+async def summary_pump():
+    while True:
+        await summary_dirty.wait()
+        await asyncio.sleep(SUMMARY_DEBOUNCE_SECONDS)
+        summary_dirty.clear()
+        # Nobody to send it to; a new subscriber sets the flag again
+        if not broadcaster.subscribers:
+            continue
+        try:
+            async with app.state.pool.acquire() as conn:
+                records = await conn.fetch("SELECT queue_name, count FROM get_queue_summary()")
+            # The dashboard looks counts up by queue name
+            summary = {record['queue_name']: record['count'] for record in records}
+            # Encoded once here and shared by every subscriber
+            await broadcaster.broadcast(orjson.dumps(summary).decode())
+        except Exception as e:
+            print(f"Error broadcasting update: {e}")
 
 @app.get("/stream/queues/summary")
 async def stream_queues_summary(request: Request):
-    queue = asyncio.Queue()
+    queue = broadcaster.new_queue()
     await broadcaster.subscribe(queue)
 
     # Send initial data on connect
-    await broadcast_update()
+    summary_dirty.set()
 
     async def event_generator():
+        last_sent = None
         try:
             while True:
                 message = await queue.get()
-                if await request.is_disconnected():
-                    break
-                yield message
+                if message != last_sent:
+                    # Snapshots are often unchanged between writes; skip repeats
+                    last_sent = message
+                    yield message
         finally:
             await broadcaster.unsubscribe(queue)
             print("Client disconnected, unsubscribed.")
 
-    return EventSourceResponse(event_generator())
+    return EventSourceResponse(event_generator(), ping=SSE_KEEPALIVE_SECONDS)
 
 
 @app.get("/dashboard", response_class=HTMLResponse)
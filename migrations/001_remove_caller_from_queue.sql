@@ -0,0 +1,37 @@
+-- Remove a caller and close the gap behind them in one round-trip.
+--
+-- The shift is a single set-based UPDATE rather than one UPDATE per caller,
+-- so removing someone near the head of a deep queue costs one statement.
+
+CREATE INDEX IF NOT EXISTS queue_qname_pos_idx ON queue (queue_name, position);
+
+CREATE OR REPLACE FUNCTION shift_positions_down(p_queue_name text, p_from_position int)
+RETURNS void
+LANGUAGE sql
+AS $$
+    UPDATE queue
+    SET position = position - 1
+    WHERE queue_name = p_queue_name
+      AND position > p_from_position;
+$$;
+
+CREATE OR REPLACE FUNCTION remove_caller_from_queue(p_phone_number text, p_queue_name text)
+RETURNS int
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    deleted_position int;
+BEGIN
+    DELETE FROM queue
+    WHERE queue_name = p_queue_name
+      AND phone_number = p_phone_number
+    RETURNING position INTO deleted_position;
+
+    IF deleted_position IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    PERFORM shift_positions_down(p_queue_name, deleted_position);
+    RETURN deleted_position;
+END;
+$$;
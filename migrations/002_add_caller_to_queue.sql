@@ -0,0 +1,49 @@
+-- Add a caller and return their position in a single statement.
+--
+-- The advisory lock serialises adds per queue so two concurrent callers can
+-- never be handed the same position. Duplicate callers are rejected by the
+-- unique index (SQLSTATE 23505) instead of a separate existence check.
+
+CREATE UNIQUE INDEX IF NOT EXISTS queue_qname_phone_idx ON queue (queue_name, phone_number);
+
+-- Earlier setup instructions had a unique constraint on (phone_number,
+-- queue_name) added by hand. The index above enforces the same rule, so drop
+-- it rather than maintain two unique indexes on every write.
+DO $$
+DECLARE
+    c record;
+BEGIN
+    FOR c IN
+        SELECT con.conname
+        FROM pg_constraint con
+        WHERE con.conrelid = 'queue'::regclass
+          AND con.contype = 'u'
+          AND (
+              SELECT array_agg(a.attname::text ORDER BY a.attname)
+              FROM unnest(con.conkey) AS k(attnum)
+              JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+          ) = ARRAY['phone_number', 'queue_name']
+    LOOP
+        EXECUTE format('ALTER TABLE queue DROP CONSTRAINT %I', c.conname);
+    END LOOP;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION add_caller_to_queue(p_phone_number text, p_queue_name text)
+RETURNS int
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    new_position int;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext(p_queue_name));
+
+    INSERT INTO queue (phone_number, queue_name, position)
+    SELECT p_phone_number, p_queue_name, COALESCE(MAX(position), 0) + 1
+    FROM queue
+    WHERE queue_name = p_queue_name
+    RETURNING position INTO new_position;
+
+    RETURN new_position;
+END;
+$$;
@@ -0,0 +1,17 @@
+-- Per-queue caller counts, grouped in the database.
+--
+-- Used by both GET /queues/summary and the live dashboard stream. An earlier
+-- hand-written version may exist with a different return type, which
+-- CREATE OR REPLACE cannot change, so drop it first.
+
+DROP FUNCTION IF EXISTS get_queue_summary();
+
+CREATE OR REPLACE FUNCTION get_queue_summary()
+RETURNS TABLE (queue_name text, count bigint)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT q.queue_name, count(*)
+    FROM queue q
+    GROUP BY q.queue_name;
+$$;
@@ -0,0 +1,13 @@
+-- Covering indexes for the hot queries.
+--
+-- Every query filters on queue_name first, then either ranges over position
+-- (the removal shift) or matches phone_number (status, duplicate check), so
+-- these turn each one into an index range scan over a single queue.
+--
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block; run each
+-- statement on its own.
+
+DROP INDEX CONCURRENTLY IF EXISTS queue_qname_pos_idx;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS queue_qname_pos_idx ON queue (queue_name, position) INCLUDE (id);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS queue_qname_phone_idx ON queue (queue_name, phone_number);
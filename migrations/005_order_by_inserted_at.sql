@@ -0,0 +1,56 @@
+-- Order callers by arrival time instead of storing dense positions.
+--
+-- A caller's position is now derived on read, so removing someone is a plain
+-- DELETE and nobody behind them has to be renumbered. id breaks ties between
+-- callers inserted in the same microsecond. Adds still take a per-queue
+-- advisory lock: without it, two concurrent adds can't see each other's
+-- uncommitted rows and would both report the same position.
+
+ALTER TABLE queue ADD COLUMN IF NOT EXISTS inserted_at timestamptz;
+UPDATE queue SET inserted_at = created_at WHERE inserted_at IS NULL;
+ALTER TABLE queue
+    ALTER COLUMN inserted_at SET DEFAULT clock_timestamp(),
+    ALTER COLUMN inserted_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS queue_qname_inserted_idx ON queue (queue_name, inserted_at, id);
+
+CREATE OR REPLACE FUNCTION add_caller_to_queue(p_phone_number text, p_queue_name text)
+RETURNS int
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    new_inserted_at timestamptz;
+    new_id bigint;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext(p_queue_name));
+
+    INSERT INTO queue (phone_number, queue_name)
+    VALUES (p_phone_number, p_queue_name)
+    RETURNING inserted_at, id INTO new_inserted_at, new_id;
+
+    RETURN (
+        SELECT count(*)
+        FROM queue
+        WHERE queue_name = p_queue_name
+          AND (inserted_at, id) <= (new_inserted_at, new_id)
+    );
+END;
+$$;
+
+-- Returns the number of callers removed (0 or 1).
+CREATE OR REPLACE FUNCTION remove_caller_from_queue(p_phone_number text, p_queue_name text)
+RETURNS int
+LANGUAGE sql
+AS $$
+    WITH deleted AS (
+        DELETE FROM queue
+        WHERE queue_name = p_queue_name
+          AND phone_number = p_phone_number
+        RETURNING 1
+    )
+    SELECT count(*)::int FROM deleted;
+$$;
+
+DROP FUNCTION IF EXISTS shift_positions_down(text, int);
+DROP INDEX IF EXISTS queue_qname_pos_idx;
+ALTER TABLE queue DROP COLUMN IF EXISTS position;
@@ -0,0 +1,19 @@
+-- Notify listeners whenever the queue table changes.
+--
+-- The service LISTENs on queue_changed to refresh the live dashboard, which
+-- also picks up changes made outside the API (admin scripts, the SQL editor).
+
+CREATE OR REPLACE FUNCTION pg_notify_queue()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_notify('queue_changed', '');
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS queue_notify ON queue;
+CREATE TRIGGER queue_notify
+AFTER INSERT OR UPDATE OR DELETE ON queue
+FOR EACH STATEMENT EXECUTE FUNCTION pg_notify_queue();
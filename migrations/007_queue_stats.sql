@@ -0,0 +1,70 @@
+-- Per-queue caller counts maintained by triggers.
+--
+-- Count and summary reads become primary-key lookups on queue_stats instead
+-- of aggregating the queue table on every request.
+
+CREATE TABLE IF NOT EXISTS queue_stats (
+    queue_name text PRIMARY KEY,
+    count int NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION queue_stats_on_insert()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO queue_stats (queue_name, count)
+    VALUES (NEW.queue_name, 1)
+    ON CONFLICT (queue_name) DO UPDATE SET count = queue_stats.count + 1;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION queue_stats_on_delete()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE queue_stats SET count = count - 1 WHERE queue_name = OLD.queue_name;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS queue_stats_insert ON queue;
+CREATE TRIGGER queue_stats_insert
+AFTER INSERT ON queue
+FOR EACH ROW EXECUTE FUNCTION queue_stats_on_insert();
+
+DROP TRIGGER IF EXISTS queue_stats_delete ON queue;
+CREATE TRIGGER queue_stats_delete
+AFTER DELETE ON queue
+FOR EACH ROW EXECUTE FUNCTION queue_stats_on_delete();
+
+-- Moving a caller between queues counts as a delete from one and an insert
+-- into the other.
+DROP TRIGGER IF EXISTS queue_stats_move_out ON queue;
+CREATE TRIGGER queue_stats_move_out
+AFTER UPDATE OF queue_name ON queue
+FOR EACH ROW WHEN (OLD.queue_name IS DISTINCT FROM NEW.queue_name)
+EXECUTE FUNCTION queue_stats_on_delete();
+
+DROP TRIGGER IF EXISTS queue_stats_move_in ON queue;
+CREATE TRIGGER queue_stats_move_in
+AFTER UPDATE OF queue_name ON queue
+FOR EACH ROW WHEN (OLD.queue_name IS DISTINCT FROM NEW.queue_name)
+EXECUTE FUNCTION queue_stats_on_insert();
+
+-- Backfill from the current queue contents
+INSERT INTO queue_stats (queue_name, count)
+SELECT queue_name, count(*) FROM queue GROUP BY queue_name
+ON CONFLICT (queue_name) DO UPDATE SET count = EXCLUDED.count;
+
+CREATE OR REPLACE FUNCTION get_queue_summary()
+RETURNS TABLE (queue_name text, count bigint)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT s.queue_name, s.count::bigint
+    FROM queue_stats s
+    WHERE s.count > 0;
+$$;
@@ -0,0 +1,14 @@
+-- Remove several callers from one queue in a single statement.
+--
+-- Positions are derived from arrival order (see 005), so no shift is needed
+-- afterwards. Returns the phone numbers that were actually in the queue.
+
+CREATE OR REPLACE FUNCTION remove_callers_batch(p_queue_name text, p_phone_numbers text[])
+RETURNS TABLE (phone_number text)
+LANGUAGE sql
+AS $$
+    DELETE FROM queue q
+    WHERE q.queue_name = p_queue_name
+      AND q.phone_number = ANY (p_phone_numbers)
+    RETURNING q.phone_number;
+$$;
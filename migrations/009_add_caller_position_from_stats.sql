@@ -0,0 +1,22 @@
+-- Report a new caller's position from queue_stats instead of counting rows.
+--
+-- The per-queue advisory lock is taken before the INSERT, so adds to one
+-- queue stamp inserted_at, bump queue_stats and read it back in the same
+-- order. A new caller is therefore last in arrival order, and their position
+-- is the queue's size after the insert. The queue_stats_insert trigger has
+-- already bumped that row by the time of the lookup. (A RETURNING clause on
+-- the INSERT would run before the AFTER trigger and miss it.)
+
+CREATE OR REPLACE FUNCTION add_caller_to_queue(p_phone_number text, p_queue_name text)
+RETURNS int
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext(p_queue_name));
+
+    INSERT INTO queue (phone_number, queue_name)
+    VALUES (p_phone_number, p_queue_name);
+
+    RETURN (SELECT count FROM queue_stats WHERE queue_name = p_queue_name);
+END;
+$$;
@@ -2,11 +2,13 @@ import asyncio
 import aiohttp
 import random
 import uuid
+from collections import deque
 
 # --- Configuration ---
 BASE_URL = "https://queuemanagement-6yti.onrender.com"
 QUEUES = ["Sales_HighVolume", "Support_Tier1", "Billing_Inquiries"]
 NUM_CONCURRENT_CALLERS = 15  # Number of simulated callers acting at once
+BATCH_SIZE = 20              # Requests each simulated caller sends per round
 TEST_DURATION_SECONDS = 120    # How long to run the test
 ADD_CALLER_CHANCE = 0.7      # 70% chance to add a caller, 30% to remove
 
@@ -24,9 +26,8 @@ async def add_caller(session, queue_name):
         async with session.post(f"{BASE_URL}/queue/increment", json=payload) as response:
             if response.status == 200:
                 print(f"[+] Added caller {phone_number} to {queue_name}")
-                if queue_name not in active_callers:
-                    active_callers[queue_name] = []
-                active_callers[queue_name].append(payload)
+                # No await between lookup and append, so this is safe across tasks
+                active_callers.setdefault(queue_name, deque()).append(payload)
             else:
                 print(f"[!] Failed to add caller. Status: {response.status}")
     except Exception as e:
@@ -38,7 +39,7 @@ async def remove_caller(session, queue_name):
         # print(f"[*] No active callers in {queue_name} to remove.")
         return
 
-    caller_to_remove = active_callers[queue_name].pop(0)
+    caller_to_remove = active_callers[queue_name].popleft()
     
     try:
         async with session.post(f"{BASE_URL}/queue/decrement", json=caller_to_remove) as response:
@@ -49,25 +50,30 @@ async def remove_caller(session, queue_name):
     except Exception as e:
         print(f"[!] Error removing caller: {e}")
 
+def random_action(session):
+    """Picks a random queue and either adds or removes a caller."""
+    queue = random.choice(QUEUES)
+    if random.random() < ADD_CALLER_CHANCE:
+        return add_caller(session, queue)
+    return remove_caller(session, queue)
+
 async def simulate_caller_activity(session):
-    """A single simulated caller's continuous activity."""
+    """A single simulated caller's continuous activity, sent in concurrent batches."""
     while True:
-        queue = random.choice(QUEUES)
-        if random.random() < ADD_CALLER_CHANCE:
-            await add_caller(session, queue)
-        else:
-            await remove_caller(session, queue)
-        
+        await asyncio.gather(*[random_action(session) for _ in range(BATCH_SIZE)])
+
         await asyncio.sleep(random.uniform(0.1, 0.5)) # Wait a short random time
 
 async def main():
     """Main function to set up and run the simulation."""
     print(f"--- Starting Stress Test for {TEST_DURATION_SECONDS} seconds ---")
     print(f"Target URL: {BASE_URL}")
-    print(f"Concurrent Callers: {NUM_CONCURRENT_CALLERS}")
+    print(f"Concurrent Callers: {NUM_CONCURRENT_CALLERS} (batches of {BATCH_SIZE})")
     print("--------------------------------------------------")
 
-    async with aiohttp.ClientSession() as session:
+    # Keep connections alive between batches to avoid repeated TLS handshakes
+    connector = aiohttp.TCPConnector(limit=200, limit_per_host=200, ttl_dns_cache=300, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector) as session:
         tasks = [asyncio.create_task(simulate_caller_activity(session)) for _ in range(NUM_CONCURRENT_CALLERS)]
         
         # Run the simulation for the specified duration